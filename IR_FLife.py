@@ -1,10 +1,233 @@
 __version__ = '0.1'
 
+import math
 import numpy as np
-import matplotlib.pyplot as plt 
 from tqdm import tqdm
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from scipy import signal
+from scipy.fft import rfft, rfftfreq
+from scipy.integrate import trapezoid
 import FLife
 
+# CuPy module and GPU availability, resolved on first use by _gpu_available() (CUDA is not initialised at import)
+cp, _GPU = None, None
+
+try:
+    from numba import njit, prange
+    _NUMBA = True
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
+    prange, _NUMBA = range, False
+
+# Minimum number of pixels for which per-pixel methods are spread over a process pool
+_PARALLEL_MIN_PIXELS = 256
+
+# Cache size targeted by the tiled spectral evaluation [bytes] (typical per-core L2)
+_CACHE_BYTES = 2**20
+
+# Minimum number of pixels of each tile, so that transforms and products stay batched for long recordings
+_TILE_MIN_PIXELS = 64
+
+# Number of load classes of the rainflow counting (as in FLife.Rainflow)
+_RAINFLOW_CLASSES = 512
+
+# Memory budget of each band of rows processed in streaming mode [bytes]
+_STREAM_BYTES = 2**28
+
+# Device memory budget of each batch of pixels of the GPU Modal evaluation [bytes]
+_GPU_BYTES = 2**30
+
+# Fatigue life estimation methods accepted by .get_life()
+_METHODS = frozenset(('Modal', 'TovoBenasciutti', 'Dirlik', 'Rainflow'))
+
+def _gpu_available():
+
+    """
+    Import CuPy and check for a CUDA device, once per process.
+
+    Return
+    ------
+    available : bool
+                True if the Modal band evaluation can run on the GPU.
+    """
+
+    global cp, _GPU
+
+    if _GPU == None:
+        try:
+            import cupy as cp
+            _GPU = bool(cp.cuda.is_available())
+        except ImportError:
+            _GPU = False
+
+    return _GPU
+
+def _rainflow_life(ds, dt, C, k):
+
+    """
+    Rainflow fatigue life of a row of pixels. Defined at module level so that it can be sent to worker processes.
+
+    Parameters
+    ----------
+    ds : array_like
+         Stress signals of the pixels in the row. Correct shape: [pixels, frames].
+
+    dt : float
+         Time between discreete signal values.
+
+    C  : float
+         Fatigue strength coefficient [MPa**k]
+
+    k  : float
+         Fatigue strength exponent [/].
+
+    Return
+    ------
+    life : array_like
+           Fatigue life [s] of every pixel in the row.
+    """
+
+    return np.array([FLife.Rainflow(FLife.SpectralData(ds_pixel, dt)).get_life(C = C, k = k) for ds_pixel in ds])
+
+@njit(cache = True)
+def _rainflow_cycles(reversals, n, k, residue):
+
+    """
+    Four-point rainflow counting of a sequence of reversals, given as load class indices.
+
+    Parameters
+    ----------
+    reversals : array_like
+                Load class indices of the reversals.
+
+    n         : int
+                Number of reversals to be counted.
+
+    k         : float
+                Fatigue strength exponent [/].
+
+    residue   : array_like
+                Buffer (at least n long) where the residue of the counting is written.
+
+    Return
+    ------
+    total     : float
+                Sum of the closed cycles ranges (in load classes) to the power of k.
+
+    m         : int
+                Length of the residue.
+    """
+
+    total = 0.0
+    m = 0
+
+    for r in range(n):
+        residue[m] = reversals[r]
+        m += 1
+
+        while m >= 4:
+            d1 = abs(residue[m-3] - residue[m-4])
+            d2 = abs(residue[m-2] - residue[m-3])
+            d3 = abs(residue[m-1] - residue[m-2])
+
+            if d2 <= d1 and d2 <= d3:
+                total += float(d2)**k
+                residue[m-3] = residue[m-1]
+                m -= 2
+            else:
+                break
+
+    return total, m
+
+@njit(cache = True, parallel = True)
+def _rainflow_damage(ds, k, nclasses):
+
+    """
+    Rainflow damage of every pixel, without the 1/C factor. Reversals are classified into nclasses load classes
+    and the residue is closed by repeating it once, as in FLife.Rainflow (four-point algorithm).
+
+    Parameters
+    ----------
+    ds       : array_like
+               Stress cube with time on the last axis. Correct shape: [width, height, frames].
+
+    k        : float
+               Fatigue strength exponent [/].
+
+    nclasses : int
+               Number of load classes.
+
+    Return
+    ------
+    damage   : array_like
+               Sum of the cycles amplitudes to the power of k. Shape: [width, height].
+    """
+
+    height, width, N = ds.shape
+    damage = np.zeros((height, width))
+
+    for p in prange(height * width):
+        y = ds[p // width, p % width]
+
+        # Load range in a single pass over the pixel history
+        y_min = y_max = y[0]
+        for t in range(1, N):
+            if y[t] < y_min:
+                y_min = y[t]
+            elif y[t] > y_max:
+                y_max = y[t]
+
+        dY = (y_max - y_min) / nclasses
+
+        if dY == 0:
+            continue
+
+        # Peak-valley filtering of the load class indices
+        reversals = np.empty(N, dtype = np.int64)
+        reversals[0] = int((y[0] - y_min) / dY + 0.5)
+        n = 1
+        direction = 0
+
+        for t in range(1, N):
+            c = int((y[t] - y_min) / dY + 0.5)
+
+            if c == reversals[n-1]:
+                continue
+
+            d = 1 if c > reversals[n-1] else -1
+
+            if n >= 2 and d == direction:
+                reversals[n-1] = c
+            else:
+                reversals[n] = c
+                n += 1
+
+            direction = d
+
+        residue = np.empty(n, dtype = np.int64)
+        total, m = _rainflow_cycles(reversals, n, k, residue)
+
+        # Close the residue by concatenating it with itself
+        if m >= 2:
+            d_start = residue[1] - residue[0]
+            d_end = residue[m-1] - residue[m-2]
+            d_join = residue[0] - residue[m-1]
+
+            head = m if (d_end * d_start > 0) == (d_end * d_join < 0) else m - 1
+            tail = 0 if d_end * d_join < 0 else 1
+
+            closed = np.empty(2 * m, dtype = np.int64)
+            closed[:head] = residue[:head]
+            closed[head:(head + m - tail)] = residue[tail:m]
+
+            total += _rainflow_cycles(closed, head + m - tail, k, np.empty(2 * m, dtype = np.int64))[0]
+
+        damage[p // width, p % width] = (dY / 2)**k * total
+
+    return damage
+
 class IR_FLife():
 
     """
@@ -21,15 +244,16 @@ class IR_FLife():
         ISBN: 9780128221907, Elsevier, 1st September 2020
      """ 
 
-    def __init__(self, x, dt, x_coord = None, y_coord = None):
+    def __init__(self, x, dt, x_coord = None, y_coord = None, dtype = None, stream = None, gpu = None):
 
         """ 
         Get needed values
 
         Parameters
         ----------
-        x       : array_like
+        x       : array_like or string
                   Thermal video of stress measurement values. Correct shape: [frames, width, height].
+                  If string, path to a .npy file, which is memory-mapped.
 
         dt      : float
                   Time between discreete signal values.
@@ -39,10 +263,34 @@ class IR_FLife():
         
         y_coord : float
                   y coordinate of pixel of interest if modal decomposition approach is used. Default to 'None'.
+
+        dtype   : data-type, optional
+                  Floating point precision used for the stress variation and its spectra.
+                  If 'None', single precision (np.float32) is used, which is sufficient for thermal cameras
+                  dynamic range; use np.float64 e.g. for sensitivity analysis. Default to 'None'.
+
+        stream  : bool, optional
+                  If True, the stress variation is never stored for the entire video: it is computed from x
+                  for bands of rows when needed, so that videos larger than memory can be processed.
+                  If 'None', streaming is used when x is memory-mapped. Default to 'None'.
+
+        gpu     : bool, optional
+                  If True, the Modal band evaluation runs on the GPU through CuPy; if False, it always runs on the CPU.
+                  If 'None', the GPU is used when CuPy and a CUDA device are available. Default to 'None'.
         
         Methods
         -------
         ._find_nearest()     : Find nearest element in array.
+
+        ._get_ds()           : Stress variation in a location.
+
+        ._spectral_moments() : Spectral moments of every pixel (cached per location).
+
+        ._tovo_benasciutti() : Tovo-Benasciutti's fatigue life map.
+
+        ._dirlik()           : Dirlik's fatigue life map.
+
+        ._modal_damage()     : Modal damage map over selected frequency bins.
         
         ._pixel_selection()  : Pixel coordinates storage.
         
@@ -50,23 +298,65 @@ class IR_FLife():
         
         .nf_identification() : Natural frequency identification.
 
+        ._life_map()         : Fatigue life map in a location.
+
         .get_life()          : Get the fatigue life.
 
         Raises
         ------
+        ValueError : Thermal video must be a 3-D array: [frames, width, height].
+        ValueError : GPU evaluation requires CuPy and a CUDA device.
         ValueError : Frequency span around natural frequency must not be zero: set it to 'None' or to a float value.
         ValueError : Method must be one of: Dirlik, Modal, Rainflow, TovoBenasciutti.
         """
         
+        if isinstance(x, str):
+            x = np.load(x, mmap_mode = 'r')
+        else:
+            x = np.asanyarray(x)
+
+        if x.ndim != 3:
+            raise ValueError('Thermal video must be a 3-D array: [frames, width, height].')
+
+        if dtype == None:
+            dtype = np.float32
+
+        if stream == None:
+            stream = isinstance(x, np.memmap)
+
+        if gpu == True and not _gpu_available():
+            raise ValueError('GPU evaluation requires CuPy and a CUDA device.')
+
         self.x = x
         self.dt = dt
         self.x_coord = x_coord
         self.y_coord = y_coord
+        self.dtype = dtype
+        self.gpu = gpu
 
         self.N = self.x.shape[0]
-        self.ds = self.x - self.x[0,:,:]
+        self.x0 = np.asarray(self.x[0,:,:])
+
+        # Stress variation w.r.t. the first frame, stored once with time on the last axis (unless streaming)
+        self.ds = None
+
+        if not stream:
+            self.ds = self._get_ds()
+
+        # Frequency vector of the rFFT, shared by all the spectral analyses
+        self.freq = rfftfreq(self.N, self.dt)
+
+        # Spectral moments cache, one entry per ROI location (None for the entire spatial domain)
+        self._moments = {}
+
+        # Direct-projection bases cache, one entry per set of frequency bins
+        self._bases = {}
+
+        # Modal frequency bins cache, one entry per (f, f_span) pair
+        self._bands = {}
     
-    def _find_nearest(self, array, value):
+    @staticmethod
+    def _find_nearest(array, value):
 
         """
         Find nearest value and its index in array
@@ -76,23 +366,288 @@ class IR_FLife():
         array : array_like
                 Array in which to find the searched value.
 
-        value : float
-                Searched value.
+        value : float or array_like
+                Searched value(s).
 
         Return
         ------
-        array[idx] : float
-                     Nearest value in array.
+        array[idx] : float or array_like
+                     Nearest value(s) in array.
 
-        idx        : int
-                     Index of nearest value.
+        idx        : int or array_like
+                     Index of nearest value(s).
         """
         
         array = np.asarray(array)
-        idx = (np.abs(array - value)).argmin()
+        idx = np.abs(array - np.asarray(value)[..., None]).argmin(axis = -1)
         
         return array[idx], idx
 
+    def _get_ds(self, location = None):
+
+        """
+        Stress variation w.r.t. the first frame in a location, with time on the last axis.
+        If the stress variation of the entire video is stored, a view is returned,
+        otherwise it is computed from the thermal video for the location only.
+
+        Parameters
+        ----------
+        location : int, optional
+                   List of ROI components (x, y, w, h). If 'None', the entire spatial domain is used. Default to 'None'.
+
+        Return
+        ------
+        ds       : array_like
+                   Stress variation. Shape: [h, w, frames].
+        """
+
+        if location is not None:
+            (x, y, w, h) = location
+        else:
+            (x, y, w, h) = (0, 0, self.x.shape[2], self.x.shape[1])
+
+        if self.ds is not None:
+            return self.ds[y:(y+h), x:(x+w)]
+
+        x_roi = self.x[:, y:(y+h), x:(x+w)]
+        ds = np.empty(x_roi.shape[1:] + (self.N,), dtype = self.dtype)
+        # Subtract in the working precision: integer frames would wrap around otherwise
+        np.subtract(np.moveaxis(x_roi, 0, -1), self.x0[y:(y+h), x:(x+w), None], out = ds, dtype = self.dtype, casting = 'same_kind')
+
+        return ds
+
+    def _spectral_moments(self, location = None):
+
+        """
+        Spectral moments m0, m1, m2 and m4 of every pixel, computed from a batched Welch PSD estimate
+        with the same settings used by FLife.SpectralData. The moments are computed once per location
+        and reused by all the spectral methods.
+
+        Parameters
+        ----------
+        location : int, optional
+                   List of ROI components (x, y, w, h). If 'None', the entire spatial domain is used. Default to 'None'.
+
+        Return
+        ------
+        m        : array_like
+                   Spectral moments m0, m1, m2, m4. Shape: [4, width, height].
+        """
+
+        key = None if location is None else tuple(location)
+
+        if key not in self._moments:
+            ds = self._get_ds(location)
+            m = np.empty((4,) + ds.shape[:-1])
+
+            # Tiles as in ._modal_damage(): the Welch segments and spectra of a tile fit in cache
+            tile = max(_TILE_MIN_PIXELS, _CACHE_BYTES // (2 * self.N * ds.itemsize))
+            tile_w = min(ds.shape[1], tile)
+            tile_h = max(1, tile // tile_w)
+
+            for i in range(0, ds.shape[0], tile_h):
+                for j in range(0, ds.shape[1], tile_w):
+                    freq, psd = signal.welch(ds[i:(i+tile_h), j:(j+tile_w)], fs = 1 / self.dt, window = 'hann', nperseg = 1280, axis = -1)
+                    omega = 2 * np.pi * freq
+
+                    for n, order in enumerate((0, 1, 2, 4)):
+                        m[n, i:(i+tile_h), j:(j+tile_w)] = trapezoid(omega**order * psd, freq, axis = -1)
+
+            self._moments[key] = m
+
+        return self._moments[key]
+
+    @staticmethod
+    def _tovo_benasciutti(m, C, k):
+
+        """
+        Tovo-Benasciutti's fatigue life (method 2) for every pixel.
+
+        Parameters
+        ----------
+        m : array_like
+            Spectral moments, as given by ._spectral_moments().
+
+        C : float
+            Fatigue strength coefficient [MPa**k]
+
+        k : float
+            Fatigue strength exponent [/].
+
+        Return
+        ------
+        life : array_like
+               Fatigue life [s].
+        """
+
+        m0, m1, m2, m4 = m
+
+        nu = np.sqrt(m2 / m0) / (2 * np.pi)
+        alpha1 = m1 / np.sqrt(m0 * m2)
+        alpha2 = m2 / np.sqrt(m0 * m4)
+
+        b = (alpha1 - alpha2) * (1.112 * (1 + alpha1 * alpha2 - (alpha1 + alpha2)) * np.exp(2.11 * alpha2) + (alpha1 - alpha2)) / ((alpha2 - 1)**2)
+        damage_nb = nu * (2 * m0)**(k / 2) * (math.gamma(1 + k / 2) / C)
+        damage = damage_nb * (b + (1 - b) * alpha2**(k - 1))
+
+        return 1 / damage
+
+    @staticmethod
+    def _dirlik(m, C, k):
+
+        """
+        Dirlik's fatigue life for every pixel.
+
+        Parameters
+        ----------
+        m : array_like
+            Spectral moments, as given by ._spectral_moments().
+
+        C : float
+            Fatigue strength coefficient [MPa**k]
+
+        k : float
+            Fatigue strength exponent [/].
+
+        Return
+        ------
+        life : array_like
+               Fatigue life [s].
+        """
+
+        m0, m1, m2, m4 = m
+
+        m_p = np.sqrt(m4 / m2) / (2 * np.pi)
+        x_m = (m1 / m0) * np.sqrt(m2 / m4)
+        alpha2 = m2 / np.sqrt(m0 * m4)
+
+        G1 = 2 * (x_m - alpha2**2) / (1 + alpha2**2)
+        R = (alpha2 - x_m - G1**2) / (1 - alpha2 - G1 + G1**2)
+        G2 = (1 - alpha2 - G1 + G1**2) / (1 - R)
+        G3 = 1 - G1 - G2
+        Q = 1.25 * (alpha2 - G3 - G2 * R) / G1
+
+        # Material and exponent constants folded into two scalars, so that the maps are traversed once per term
+        g1 = math.gamma(1 + k) / C
+        g2 = 2**(k / 2) * math.gamma(1 + k / 2) / C
+
+        damage = m_p * m0**(k / 2) * (G1 * Q**k * g1 + g2 * (G2 * np.abs(R)**k + G3))
+
+        return 1 / damage
+
+    def _modal_damage(self, ds, band_idx, C, k):
+
+        """
+        Modal damage of every pixel, summed over the given frequency bins.
+        When only a few bins are needed, they are evaluated directly as projections on the corresponding
+        cosine and sine (Goertzel-like, O(N) per bin) instead of computing the whole spectrum with the FFT.
+        The projection bases are cached, so repeated calls on the same band skip their construction.
+        The spectrum evaluation and the damage reduction are fused and carried out on tiles of pixels
+        sized to stay in cache, so that the spectrum of the entire ROI is never held in memory.
+        If CuPy and a CUDA device are available, the whole ROI is processed at once on the GPU.
+
+        Parameters
+        ----------
+        ds       : array_like
+                   Stress cube with time on the last axis. Correct shape: [width, height, frames].
+
+        band_idx : array_like
+                   Indices of the frequency bins in .freq.
+
+        C        : float
+                   Fatigue strength coefficient [MPa**k]
+
+        k        : float
+                   Fatigue strength exponent [/].
+
+        Return
+        ------
+        damage   : array_like
+                   Damage intensity [1/s]. Shape: [width, height].
+        """
+
+        x_peak = self.freq[band_idx]
+        scale = (2 / self.N)**k / C
+        nbins = len(band_idx)
+
+        if nbins < math.log2(self.N):
+            key = (tuple(band_idx), ds.dtype)
+
+            if key not in self._bases:
+                phase = 2 * np.pi * (np.outer(np.arange(self.N), band_idx) % self.N) / self.N
+                self._bases[key] = np.hstack((np.cos(phase), np.sin(phase))).astype(ds.dtype)
+
+            basis = self._bases[key]
+        else:
+            basis = None
+
+        damage = np.empty(ds.shape[:-1])
+
+        if (_gpu_available() if self.gpu == None else self.gpu):
+            basis_gpu = cp.asarray(basis) if basis is not None else None
+            band_gpu, x_peak_gpu = cp.asarray(band_idx), cp.asarray(x_peak)
+
+            # Batches of (batch_h, batch_w) pixels whose signals and full spectra (plus the FFT workspace)
+            # fit in the device memory budget
+            batch = max(1, _GPU_BYTES // (3 * self.N * ds.itemsize))
+            batch_w = min(ds.shape[1], batch)
+            batch_h = max(1, batch // batch_w)
+
+            for i in range(0, ds.shape[0], batch_h):
+                for j in range(0, ds.shape[1], batch_w):
+                    ds_batch = ds[i:(i+batch_h), j:(j+batch_w)]
+                    d = cp.asarray(ds_batch).reshape(-1, self.N)
+
+                    if basis_gpu is not None:
+                        z_peak = d @ basis_gpu
+                        z_real, z_imag = z_peak[:, :nbins], z_peak[:, nbins:]
+                    else:
+                        z_peak = cp.fft.rfft(d, self.N, axis = -1)[:, band_gpu]
+                        z_real, z_imag = z_peak.real, z_peak.imag
+
+                    power = z_real.astype(cp.float64)**2
+                    power += z_imag.astype(cp.float64)**2
+                    cp.power(power, k / 2, out = power)
+
+                    damage[i:(i+batch_h), j:(j+batch_w)] = ((power @ x_peak_gpu) * scale).reshape(ds_batch.shape[:-1]).get()
+
+            return damage
+
+        # Tile of (tile_h, tile_w) pixels whose signals and spectra fit in cache, but never smaller
+        # than _TILE_MIN_PIXELS: for long recordings that would bring back a per-pixel loop
+        tile = max(_TILE_MIN_PIXELS, _CACHE_BYTES // (2 * self.N * ds.itemsize))
+        tile_w = min(ds.shape[1], tile)
+        tile_h = max(1, tile // tile_w)
+
+        # Work buffers of a full tile, reused (as views of their leading part) by every tile
+        power_buf = np.empty(tile_h * tile_w * nbins)
+        imag_buf = np.empty(tile_h * tile_w * nbins)
+        z_buf = np.empty(tile_h * tile_w * 2 * nbins, dtype = ds.dtype) if basis is not None else None
+
+        for i in range(0, ds.shape[0], tile_h):
+            for j in range(0, ds.shape[1], tile_w):
+                ds_tile = ds[i:(i+tile_h), j:(j+tile_w)]
+                shape = ds_tile.shape[:-1] + (nbins,)
+                size = ds_tile.shape[0] * ds_tile.shape[1] * nbins
+
+                if basis is not None:
+                    z_peak = np.matmul(ds_tile, basis, out = z_buf[:(2 * size)].reshape(shape[:-1] + (2 * nbins,)))
+                    z_real, z_imag = z_peak[..., :nbins], z_peak[..., nbins:]
+                else:
+                    z_peak = rfft(ds_tile, self.N, axis = -1, workers = -1)[..., band_idx]
+                    z_real, z_imag = z_peak.real, z_peak.imag
+
+                # Accumulate in double precision: the power is raised to k/2 (in place),
+                # then weighted by the frequencies and summed over the band in one product
+                power = np.square(z_real, out = power_buf[:size].reshape(shape), dtype = np.float64)
+                power += np.square(z_imag, out = imag_buf[:size].reshape(shape), dtype = np.float64)
+                np.power(power, k / 2, out = power)
+
+                damage_tile = np.matmul(power, x_peak, out = damage[i:(i+tile_h), j:(j+tile_w)])
+                damage_tile *= scale
+
+        return damage
+
     def _pixel_selection(self, event):
 
         """
@@ -107,6 +662,8 @@ class IR_FLife():
                   y coordinate of pixel of interest if modal decomposition approach is used.
         """
 
+        import matplotlib.pyplot as plt
+
         self.x_coord, self.y_coord = event.xdata, event.ydata
         plt.close()
 
@@ -118,10 +675,13 @@ class IR_FLife():
         Plot figure for click mouse selection.
         
         """
-        
+
+        # Imported here: matplotlib is only needed for the interactive selection
+        import matplotlib.pyplot as plt
+
         fig = plt.figure()
         ax = fig.add_subplot(111)
-        ax.imshow(self.x[0,:,:])
+        ax.imshow(self.x0)
         fig.canvas.mpl_connect('button_press_event', self._pixel_selection)
         plt.show()
             
@@ -162,16 +722,72 @@ class IR_FLife():
         else:
             (x, y, w, h) = (int(int(self.x_coord) - (roi_size-1)/2), int(int(self.y_coord) - (roi_size-1)/2), roi_size, roi_size)
             
-        self.ds = self.ds[:, y:(y+h), x:(x+w)]
+        ds = self._get_ds((x, y, w, h))
 
-        fft = np.abs(np.fft.rfft(self.ds, self.N, axis = 0) * 2 / self.N)
-        freq = np.fft.rfftfreq(self.N, self.dt)
+        freq = self.freq
+        band_idx = np.flatnonzero((freq > band_pass[0]) & (freq < band_pass[1]))
 
-        ampl_nf = np.max(fft[(freq > band_pass[0]) & (freq < band_pass[1])])
-        nf = freq[np.where(fft == ampl_nf)[0][0]]
+        fft = np.abs(rfft(ds, self.N, axis = -1, workers = -1)[..., band_idx])
+        ampl_band = fft.reshape(-1, len(band_idx)).max(axis = 0)
+        nf = freq[band_idx[np.argmax(ampl_band)]]
 
         return np.round(nf, 2)    
 
+    def _life_map(self, C, k, method, f, f_span, location = None):
+
+        """
+        Fatigue life of every pixel in a location. Parameters are as in .get_life().
+
+        Return
+        ------
+        life : array_like
+               Fatigue life [s]. Shape: [h, w].
+        """
+
+        if method == 'Modal':
+
+            ds = self._get_ds(location)
+
+            if (f, f_span) not in self._bands:
+                freq = self.freq
+                band_idx = np.flatnonzero((freq >= f - f_span) & (freq <= f + f_span))
+
+                # Span narrower than the frequency resolution: use the nearest bin
+                if band_idx.size == 0:
+                    band_idx = np.atleast_1d(self._find_nearest(freq, f)[1])
+
+                self._bands[(f, f_span)] = band_idx
+
+            band_idx = self._bands[(f, f_span)]
+            life = 1 / self._modal_damage(ds, band_idx, C, k)
+
+        elif method == 'TovoBenasciutti':
+
+            life = self._tovo_benasciutti(self._spectral_moments(location), C, k)
+
+        elif method == 'Dirlik':
+
+            life = self._dirlik(self._spectral_moments(location), C, k)
+
+        elif method == 'Rainflow':
+
+            ds = self._get_ds(location)
+
+            if _NUMBA:
+                life = self.N * self.dt * C / _rainflow_damage(ds, k, _RAINFLOW_CLASSES)
+
+            else:
+                args = (ds, repeat(self.dt), repeat(C), repeat(k))
+                npixels = ds.shape[0] * ds.shape[1]
+
+                if npixels >= _PARALLEL_MIN_PIXELS:
+                    with ProcessPoolExecutor() as executor:
+                        life = np.array(list(tqdm(executor.map(_rainflow_life, *args), total = ds.shape[0])))
+                else:
+                    life = np.array(list(tqdm(map(_rainflow_life, *args), total = ds.shape[0])))
+
+        return life
+
     def get_life(self, C, k, method = None, f = None, location = None, f_span = None):
 
         """
@@ -199,6 +815,8 @@ class IR_FLife():
                       List of ROI components (x, y, w, h): x and y are the upper left coordinates of the ROI,
                       and w and h are the width and the height of the ROI, respectively. If 'None', fatigue life is estimated 
                       for the entire spatial domain, otherwise maximum value in the ROI location is given. Default to 'None'.
+                      A list of ROIs, shape [n, 4], can be given as well: the life map is then estimated once on
+                      their bounding box and the value in each ROI is returned.
 
         f_span      : float, optional
                       Frequency span around the natural frequency where to find the maximum value for the fatigue life estimation, if modal decomposition approach is used.
@@ -206,14 +824,11 @@ class IR_FLife():
 
         Return
         ------
-        life        : float
-                      Fatigue life [s].
+        life        : float or array_like
+                      Fatigue life [s]. Shape: [n] if a list of ROIs is given.
 
         """
 
-        self.N = self.x.shape[0]
-        self.ds = self.x - self.x[0,:,:]
-
         if f_span == None:
             f_span = 0.1
 
@@ -223,61 +838,40 @@ class IR_FLife():
         if f_span == 0:
             raise ValueError('Frequency span around natural frequency must not be zero: set it to "None" or to a float nonzero value.')
 
-        if method not in ['Modal', 'TovoBenasciutti', 'Dirlik', 'Rainflow']:
+        if method not in _METHODS:
             raise ValueError('Method must be one of: Dirlik, Modal, Rainflow, TovoBenasciutti.')
 
         
         if method == 'Modal' and f == None:
             raise ValueError('Natural frequency must be defined if modal approach is used.')
 
-        if location is not None:
-            (x, y, w, h) = location    
-            self.ds = self.ds[:, y:(y+h), x:(x+w)]
-
-        life = np.zeros(shape=(self.ds.shape[1], self.ds.shape[2]))
-        npixels = self.ds.shape[1] * self.ds.shape[2]  
-
-        with tqdm(total = npixels) as pbar:   
-                for i in range(self.ds.shape[1]):
-                    for j in range(self.ds.shape[2]):        
-
-                        if method == 'Modal':
-
-                            fft  = np.abs(np.fft.rfft(self.ds[:,i,j], self.N) * 2 / self.N)
-                            freq = np.fft.rfftfreq(self.N, self.dt)
-
-                            if f_span is not None:
-                                x_peak = freq[(freq >= f - f_span) & (freq <= f + f_span)]
-                                y_peak = fft[(freq >= f - f_span) & (freq <= f + f_span)]
-                                damage = np.sum(x_peak / (C / y_peak**k))
+        # Several ROIs: a single life map on their bounding box
+        locations = None
 
-                            else:
-                                x_peak = self._find_nearest(freq, f)[0]    
-                                y_peak = fft[self._find_nearest(freq, f)[1]]    
-                                damage = x_peak / (C / y_peak**k)
+        if location is not None and np.ndim(location) == 2:
+            locations = np.asarray(location, dtype = int)
+            (x0, y0) = locations[:, :2].min(axis = 0)
+            (x1, y1) = (locations[:, :2] + locations[:, 2:]).max(axis = 0)
+            location = (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
 
-                            life[i,j] = 1 / damage
-                            pbar.update(1)
+        if self.ds is None:
+            if location is not None:
+                (x, y, w, h) = location
+            else:
+                (x, y, w, h) = (0, 0, self.x.shape[2], self.x.shape[1])
 
-                        elif method == 'TovoBenasciutti':
-
-                            tb = FLife.TovoBenasciutti(FLife.SpectralData(self.ds[:,i,j], self.dt))
-                            life[i,j] = tb.get_life(C = C, k = k, method = "method 2")
-                            pbar.update(1)
-
-                        elif method == 'Dirlik':
-
-                            dirlik = FLife.Dirlik(FLife.SpectralData(self.ds[:,i,j], self.dt))
-                            life[i,j] = dirlik.get_life(C = C, k = k)
-                            pbar.update(1)
-
-                        elif method == 'Rainflow':
+            rows = max(1, _STREAM_BYTES // (w * self.N * np.dtype(self.dtype).itemsize))
+            life = np.vstack([self._life_map(C, k, method, f, f_span, (x, i, w, min(rows, y + h - i))) for i in range(y, y + h, rows)])
+        else:
+            life = self._life_map(C, k, method, f, f_span, location)
 
-                            rf = FLife.Rainflow(FLife.SpectralData(self.ds[:,i,j], self.dt))
-                            life[i,j] = rf.get_life(C = C, k = k)
-                            pbar.update(1)
+        if locations is not None:
+            # Average over the pixels actually in each ROI: slicing clips the ROIs running past the frame edge
+            rois = [life[(y - location[1]):(y - location[1] + h), (x - location[0]):(x - location[0] + w)] for (x, y, w, h) in locations]
 
-        if location is not None:
-            return np.mean(life, axis = (0,1))
+            return np.array([roi.sum(dtype = np.float64) * (1 / roi.size) for roi in rois])
+        elif location is not None:
+            # Average in double precision: float32 lives of large ROIs lose digits otherwise
+            return life.sum(dtype = np.float64) * (1 / life.size)
         else:
             return life
\ No newline at end of file